@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片压缩性能基准测试
+生成可复现的测试图片集，运行 compress_images 的压缩流程，并把结果保存为 JSON 便于对比
+
+用法:
+  python benchmark_compress.py generate bench_corpus --count 24 --seed 1
+  python benchmark_compress.py run bench_corpus --workers 1 4 --out bench_result.json
+  python benchmark_compress.py compare bench_base.json bench_result.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+import compress_images
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，无法统计 getrusage 峰值内存
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # 没有 psutil 时在 Linux 上读取 /proc 统计进程树内存
+    psutil = None
+
+# 测试图片的组合：(格式, 模式)
+CORPUS_KINDS = [
+    ('JPEG', 'RGB'),
+    ('JPEG', 'L'),
+    ('PNG', 'RGB'),
+    ('PNG', 'RGBA'),
+    ('PNG', 'P'),
+]
+CORPUS_MIN_MB = 1
+CORPUS_MAX_MB = 20
+CORPUS_MANIFEST = 'corpus.json'
+
+# 对比结果时，吞吐量下降或峰值内存上升超过该比例视为退化
+REGRESSION_THRESHOLD = 0.10
+# 采样进程树内存的间隔（秒），间隔内的短暂尖峰可能采样不到
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def make_image(rng, mode, width, height):
+    """生成渐变 + 噪声的图片：比纯噪声更接近照片，JPEG 压缩有实际的质量取舍"""
+    gradient = Image.linear_gradient('L').resize((width, height))
+    base = Image.merge('RGB', (gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT), gradient.rotate(90)))
+    noise = Image.frombytes('RGB', (width, height), rng.randbytes(width * height * 3))
+    img = Image.blend(base, noise, rng.uniform(0.15, 0.5))
+
+    if mode == 'L':
+        return img.convert('L')
+    if mode == 'RGBA':
+        alpha = Image.frombytes('L', (width, height), rng.randbytes(width * height))
+        img.putalpha(Image.blend(gradient, alpha, 0.3))
+        return img
+    if mode == 'P':
+        return img.quantize(colors=256)
+    return img
+
+
+def save_image(img, path, fmt):
+    """按格式保存图片，返回文件大小"""
+    if fmt == 'JPEG':
+        img.save(path, 'JPEG', quality=98)
+    else:
+        img.save(path, 'PNG')
+    return os.path.getsize(path)
+
+
+def generate_corpus(out_dir, count=24, seed=1):
+    """
+    生成可复现的测试图片集（相同 seed 生成相同文件）
+    各文件大小在 CORPUS_MIN_MB ~ CORPUS_MAX_MB 之间，清单写入 corpus.json
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    files = []
+
+    for index in range(count):
+        fmt, mode = CORPUS_KINDS[index % len(CORPUS_KINDS)]
+        target_bytes = int(rng.uniform(CORPUS_MIN_MB, CORPUS_MAX_MB) * 1024 * 1024)
+        aspect = rng.choice([4 / 3, 3 / 2, 1.0, 3 / 4])
+        ext = '.jpg' if fmt == 'JPEG' else '.png'
+        path = os.path.join(out_dir, f"{index:03d}_{mode.lower()}{ext}")
+        image_seed = rng.getrandbits(32)
+
+        # 先用小图估算每像素字节数，再按目标大小确定尺寸
+        sample = make_image(random.Random(image_seed), mode, 256, 256)
+        sample_path = path + '.sample'
+        bytes_per_pixel = save_image(sample, sample_path, fmt) / (256 * 256)
+        os.remove(sample_path)
+
+        pixels = target_bytes / bytes_per_pixel
+        width = max(64, int((pixels * aspect) ** 0.5))
+        height = max(64, int(width / aspect))
+        size = save_image(make_image(random.Random(image_seed), mode, width, height), path, fmt)
+
+        files.append({
+            'name': os.path.basename(path),
+            'format': fmt,
+            'mode': mode,
+            'width': width,
+            'height': height,
+            'size': size,
+        })
+        print(f"[{index + 1}/{count}] {files[-1]['name']} {width}x{height} {compress_images.format_size(size)}")
+
+    with open(os.path.join(out_dir, CORPUS_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump({'seed': seed, 'count': count, 'files': files}, f, ensure_ascii=False, indent=2)
+
+    return files
+
+
+def rusage_peaks():
+    """
+    getrusage 记录的峰值内存（字节）：(当前进程, 已结束子进程中最大的单个进程)
+    RUSAGE_CHILDREN 是单个子进程的峰值而不是总和，并行时不能代表整次运行所需的内存；
+    不支持的平台返回 (None, None)
+    """
+    if resource is None:
+        return None, None
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    scale = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own * scale, children * scale
+
+
+def _proc_descendants(pid):
+    """读取 /proc 中各进程的父进程，返回 pid 的所有后代进程"""
+    parents = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat', encoding='utf-8') as f:
+                # 进程名可能含空格，从最后一个 ')' 之后开始解析：状态 父进程 ...
+                fields = f.read().rsplit(')', 1)[1].split()
+            parents[int(name)] = int(fields[1])
+        except (OSError, IndexError, ValueError):
+            continue
+
+    result = []
+    frontier = [pid]
+    while frontier:
+        children = [child for child, parent in parents.items() if parent in frontier]
+        result.extend(children)
+        frontier = children
+    return result
+
+
+def tree_rss_bytes(pid):
+    """进程及其所有子进程当前 RSS 的总和（字节），无法统计的平台返回 None"""
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            processes = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return None
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                pass  # 采样期间已退出的子进程
+        return total
+
+    if not os.path.exists(f'/proc/{pid}/statm'):
+        return None
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    for process in [pid] + _proc_descendants(pid):
+        try:
+            with open(f'/proc/{process}/statm', encoding='utf-8') as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            pass
+    return total
+
+
+@contextlib.contextmanager
+def track_tree_rss(interval=RSS_SAMPLE_INTERVAL):
+    """
+    后台线程定期采样当前进程及所有子进程（包括进程池中的 worker）的 RSS 总和
+    退出后 peak['bytes'] 为采样到的峰值，无法统计时为 None
+    """
+    pid = os.getpid()
+    peak = {'bytes': None}
+    if tree_rss_bytes(pid) is None:
+        yield peak
+        return
+
+    stop = threading.Event()
+
+    def sample():
+        while True:
+            total = tree_rss_bytes(pid)
+            if total is not None and total > (peak['bytes'] or 0):
+                peak['bytes'] = total
+            if stop.wait(interval):
+                return
+
+    thread = threading.Thread(target=sample, daemon=True)
+    thread.start()
+    try:
+        yield peak
+    finally:
+        stop.set()
+        thread.join()
+
+
+def snapshot(directory):
+    """记录目录中每个文件的 (大小, 修改时间)"""
+    result = {}
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            path = os.path.join(root, file)
+            st = os.stat(path)
+            result[path] = (st.st_size, st.st_mtime_ns)
+    return result
+
+
+def bytes_written(before, after):
+    """统计运行后新增或被改写的文件总大小"""
+    return sum(size for path, (size, mtime) in after.items() if before.get(path) != (size, mtime))
+
+
+def run_case(case, work_dir, workers=1, max_dimension=None):
+    """
+    在当前进程中运行一个测试用例，返回测量结果
+    case: 'compress_image' 逐个调用 compress_image；'scan_directory' 走完整扫描流程
+    """
+    # 统计 JPEG 编码次数（并行模式下编码发生在子进程中，无法统计）
+    encodes = [0]
+    encode_jpeg = compress_images.encode_jpeg
+
+    def counting_encode(img, quality):
+        encodes[0] += 1
+        return encode_jpeg(img, quality)
+
+    compress_images.encode_jpeg = counting_encode
+
+    paths = list(compress_images.iter_images(work_dir))
+    input_bytes = sum(os.path.getsize(path) for path in paths)
+    large_files = sum(1 for path in paths if os.path.getsize(path) > compress_images.TARGET_SIZE_BYTES) or 1
+    before = snapshot(work_dir)
+
+    # 逐文件输出本身也是开销的一部分，照常打印到内存中再丢弃
+    with contextlib.redirect_stdout(io.StringIO()), track_tree_rss() as tree_peak:
+        start = time.perf_counter()
+        if case == 'compress_image':
+            for path in paths:
+                if os.path.getsize(path) > compress_images.TARGET_SIZE_BYTES:
+                    compress_images.compress_image(path, max_dimension)
+        else:
+            compress_images.scan_directory(work_dir, workers=workers, max_dimension=max_dimension)
+        seconds = time.perf_counter() - start
+
+    main_peak, largest_child_peak = rusage_peaks()
+    # 采样可能漏掉短暂尖峰，进程树峰值至少不低于任一单个进程的峰值
+    tree_peak = max(filter(None, [tree_peak['bytes'], main_peak, largest_child_peak]), default=None)
+    return {
+        'case': case,
+        'workers': workers,
+        'max_dimension': max_dimension,
+        'files': len(paths),
+        'input_bytes': input_bytes,
+        'seconds': round(seconds, 4),
+        'files_per_sec': round(len(paths) / seconds, 3) if seconds else None,
+        'mb_per_sec': round(input_bytes / (1024 * 1024) / seconds, 3) if seconds else None,
+        'encodes': encodes[0] if workers <= 1 else None,
+        'encodes_per_file': round(encodes[0] / large_files, 3) if workers <= 1 else None,
+        'bytes_written': bytes_written(before, snapshot(work_dir)),
+        # 进程树（主进程 + 所有 worker）同时占用内存的采样峰值，用来确定并行进程数
+        'peak_tree_rss_bytes': tree_peak,
+        'peak_main_rss_bytes': main_peak,
+        'peak_largest_child_rss_bytes': largest_child_peak or None,
+    }
+
+
+def run_isolated(corpus_dir, case, workers=1, max_dimension=None):
+    """复制测试图片集后在独立子进程中运行用例，保证峰值内存互不影响"""
+    with tempfile.TemporaryDirectory(prefix='bench_') as tmp:
+        work_dir = os.path.join(tmp, 'corpus')
+        shutil.copytree(corpus_dir, work_dir, ignore=shutil.ignore_patterns(CORPUS_MANIFEST))
+
+        command = [sys.executable, os.path.abspath(__file__), '_case', work_dir, case,
+                   '--workers', str(workers)]
+        if max_dimension:
+            command += ['--max-dimension', str(max_dimension)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+
+def run_benchmark(corpus_dir, workers_list=(1,), max_dimension=None):
+    """运行全部用例，返回可保存为 JSON 的结果"""
+    cases = [('compress_image', 1)] + [('scan_directory', workers) for workers in workers_list]
+    results = []
+    for case, workers in cases:
+        result = run_isolated(corpus_dir, case, workers, max_dimension)
+        results.append(result)
+        print_result(result)
+
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pillow': Image.__version__,
+        'platform': platform.platform(),
+        'corpus': os.path.abspath(corpus_dir),
+        'results': results,
+    }
+
+
+def print_result(result):
+    """显示一个用例的测量结果"""
+    name = f"{result['case']}(workers={result['workers']})"
+    encodes = result['encodes_per_file']
+
+    def size(key):
+        value = result.get(key)
+        return compress_images.format_size(value) if value else '-'
+
+    print(f"  {name:<32} {result['files_per_sec']:>8} 文件/秒 {result['mb_per_sec']:>8} MB/秒"
+          f"  编码次数/文件: {encodes if encodes is not None else '-'}"
+          f"  写入: {compress_images.format_size(result['bytes_written'])}"
+          f"  进程树峰值内存: {size('peak_tree_rss_bytes')}"
+          f"（主进程 {size('peak_main_rss_bytes')}，单个子进程最大 {size('peak_largest_child_rss_bytes')}）")
+
+
+def _case_key(result):
+    return result['case'], result['workers'], result['max_dimension']
+
+
+def compare_results(base, current, threshold=REGRESSION_THRESHOLD):
+    """对比两次结果，返回退化项说明列表"""
+    base_results = {_case_key(result): result for result in base['results']}
+    regressions = []
+
+    for result in current['results']:
+        old = base_results.get(_case_key(result))
+        if old is None:
+            continue
+        name = f"{result['case']}(workers={result['workers']})"
+
+        for metric in ('files_per_sec', 'mb_per_sec'):
+            if old[metric] and result[metric] is not None and result[metric] < old[metric] * (1 - threshold):
+                regressions.append(f"{name} {metric}: {old[metric]} -> {result[metric]}")
+        for metric in ('encodes_per_file', 'bytes_written', 'peak_tree_rss_bytes',
+                       'peak_main_rss_bytes', 'peak_largest_child_rss_bytes'):
+            if old.get(metric) and result.get(metric) is not None and result[metric] > old[metric] * (1 + threshold):
+                regressions.append(f"{name} {metric}: {old[metric]} -> {result[metric]}")
+
+    return regressions
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="图片压缩性能基准测试")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help="生成测试图片集")
+    generate.add_argument('out_dir')
+    generate.add_argument('--count', type=int, default=24)
+    generate.add_argument('--seed', type=int, default=1)
+
+    run = commands.add_parser('run', help="运行基准测试")
+    run.add_argument('corpus_dir')
+    run.add_argument('--workers', type=int, nargs='+', default=[1])
+    run.add_argument('--max-dimension', type=compress_images.positive_int, default=None)
+    run.add_argument('--out', default='bench_result.json')
+
+    compare = commands.add_parser('compare', help="对比两次基准测试结果")
+    compare.add_argument('base')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+
+    # 内部使用：在独立子进程中运行单个用例
+    case = commands.add_parser('_case')
+    case.add_argument('work_dir')
+    case.add_argument('case', choices=['compress_image', 'scan_directory'])
+    case.add_argument('--workers', type=int, default=1)
+    case.add_argument('--max-dimension', type=compress_images.positive_int, default=None)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.command == 'generate':
+        generate_corpus(args.out_dir, args.count, args.seed)
+
+    elif args.command == 'run':
+        print(f"基准测试: {args.corpus_dir}")
+        report = run_benchmark(args.corpus_dir, args.workers, args.max_dimension)
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.out}")
+
+    elif args.command == 'compare':
+        with open(args.base, encoding='utf-8') as f:
+            base = json.load(f)
+        with open(args.current, encoding='utf-8') as f:
+            current = json.load(f)
+        regressions = compare_results(base, current, args.threshold)
+        if regressions:
+            print("发现性能退化:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("未发现性能退化")
+
+    elif args.command == '_case':
+        result = run_case(args.case, args.work_dir, args.workers, args.max_dimension)
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+网页图片资源构建工具
+把 public/ 下的大图和图标生成多种宽度的 WebP / AVIF 版本，每张源图只解码一次，
+并写出资源清单，供页面的 <picture> / srcSet 和 public/manifest.json 的图标引用
+
+用法:
+  python build_image_assets.py
+  python build_image_assets.py --formats webp
+"""
+
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+from PIL import Image, features
+
+import compress_images
+
+# 配置参数
+PUBLIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public')
+OUTPUT_SUBDIR = 'optimized'
+MANIFEST_NAME = 'asset-manifest.json'
+
+# 源图（相对 public/ 的 glob）及要生成的宽度（按页面显示尺寸的 1x / 2x / 3x）
+# "Sri K. Pattabhi Jois.jpg" 与 .png 是同一张照片，页面使用的是 .png
+ASSET_SOURCES = [
+    ('Sri K. Pattabhi Jois.png', [128, 256, 384]),
+    ('icon.png', [48, 96, 192, 512]),
+    ('apple-icon.png', [180]),
+    ('icon-green.png', [96, 192, 288]),
+    ('icon-light.png', [96, 192, 288]),
+    ('moon-phase/*.png', [32]),
+]
+
+# 输出格式：格式 -> (MIME 类型, 扩展名)
+OUTPUT_FORMATS = {
+    'avif': ('image/avif', '.avif'),
+    'webp': ('image/webp', '.webp'),
+}
+# manifest.json 图标使用的格式（所有浏览器都支持 WebP，AVIF 作为 <picture> 的优先候选）
+ICON_FORMAT = 'webp'
+# 用作 manifest.json 图标的源图
+MANIFEST_ICON_SOURCE = 'icon.png'
+
+# 大小目标：每像素字节数，小图至少保留 MIN_BYTES
+BYTES_PER_PIXEL = 0.25
+MIN_BYTES = 6 * 1024
+# 质量档位：从 90 到 40，每档相差 5
+ASSET_QUALITY_STEPS = list(range(90, 35, -5))
+
+
+def encode_webp(img, quality):
+    """在内存中把图片编码为 WebP"""
+    buffer = io.BytesIO()
+    img.save(buffer, 'WEBP', quality=quality, method=6)
+    return buffer.getvalue()
+
+
+def encode_avif(img, quality):
+    """在内存中把图片编码为 AVIF"""
+    buffer = io.BytesIO()
+    img.save(buffer, 'AVIF', quality=quality)
+    return buffer.getvalue()
+
+
+ENCODERS = {
+    'webp': encode_webp,
+    'avif': encode_avif,
+}
+
+
+def available_formats(formats):
+    """过滤掉当前 Pillow 不支持的格式"""
+    result = []
+    for fmt in formats:
+        if features.check(fmt):
+            result.append(fmt)
+        else:
+            print(f"  [!] 当前 Pillow 不支持 {fmt.upper()}，跳过该格式")
+    return result
+
+
+def byte_budget(width, height):
+    """单个输出文件的大小目标（字节）"""
+    return max(MIN_BYTES, int(width * height * BYTES_PER_PIXEL))
+
+
+def target_widths(source_width, widths):
+    """要生成的宽度：不放大，超过原图宽度的合并为原图宽度"""
+    return sorted({min(width, source_width) for width in widths})
+
+
+def output_name(relative_path, width, ext):
+    """输出文件名：空格换成 -，附加宽度，例如 moon-phase/full-moon-32w.webp"""
+    path = Path(relative_path)
+    stem = path.stem.replace(' ', '-')
+    return (path.parent / f"{stem}-{width}w{ext}").as_posix()
+
+
+def to_url(relative_path):
+    """public/ 下的相对路径转为网站 URL"""
+    return '/' + Path(relative_path).as_posix()
+
+
+def build_asset(relative_path, widths, formats, output_dir):
+    """
+    解码一次源图，生成所有宽度和格式的变体
+    返回：清单中该源图的记录
+    """
+    source_path = os.path.join(PUBLIC_DIR, relative_path)
+    with Image.open(source_path) as source:
+        source.load()
+        # WebP / AVIF 都支持透明通道，保留 alpha
+        has_alpha = 'A' in source.getbands() or 'transparency' in source.info
+        img = source if source.mode in ('RGB', 'RGBA') else source.convert('RGBA' if has_alpha else 'RGB')
+
+        entry = {
+            'width': img.width,
+            'height': img.height,
+            'bytes': os.path.getsize(source_path),
+            'variants': [],
+        }
+        print(f"\n{relative_path} ({img.width}x{img.height}, {compress_images.format_size(entry['bytes'])})")
+
+        for width in target_widths(img.width, widths):
+            height = max(1, round(img.height * width / img.width))
+            if width == img.width:
+                resized = img
+            else:
+                resized = img.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+            budget = byte_budget(width, height)
+
+            for fmt in formats:
+                quality, data, attempts = compress_images.search_quality(
+                    resized, budget, encode=ENCODERS[fmt], steps=ASSET_QUALITY_STEPS
+                )
+                mime, ext = OUTPUT_FORMATS[fmt]
+                name = output_name(relative_path, width, ext)
+                out_path = os.path.join(output_dir, name)
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                with open(out_path, 'wb') as f:
+                    f.write(data)
+
+                entry['variants'].append({
+                    'src': to_url(f"{OUTPUT_SUBDIR}/{name}"),
+                    'format': fmt,
+                    'type': mime,
+                    'width': width,
+                    'height': height,
+                    'bytes': len(data),
+                    'quality': quality,
+                })
+                flag = "OK" if len(data) <= budget else "超出目标"
+                print(f"  [{flag}] {name}: {compress_images.format_size(len(data))} "
+                      f"(目标 {compress_images.format_size(budget)}, 质量 {quality}, 编码 {attempts} 次)")
+
+    return entry
+
+
+def build_manifest(assets):
+    """
+    生成资源清单：每张源图的全部变体、manifest.json 可用的图标
+    变体只在页面引用后由 public/sw.js 按需缓存，不做预缓存，避免增加首次加载的流量
+    """
+    icons = []
+    for source_url, entry in assets.items():
+        for variant in entry['variants']:
+            if variant['format'] != ICON_FORMAT:
+                continue
+            if source_url == to_url(MANIFEST_ICON_SOURCE) and variant['width'] == variant['height']:
+                icons.append({
+                    'src': variant['src'],
+                    'sizes': f"{variant['width']}x{variant['height']}",
+                    'type': variant['type'],
+                })
+
+    return {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'assets': assets,
+        'icons': icons,
+    }
+
+
+def build_assets(formats=tuple(OUTPUT_FORMATS)):
+    """处理全部源图，写出资源清单，返回清单内容"""
+    formats = available_formats(formats)
+    if not formats:
+        print("\n[错误] 没有可用的输出格式")
+        sys.exit(1)
+
+    output_dir = os.path.join(PUBLIC_DIR, OUTPUT_SUBDIR)
+    assets = {}
+    for pattern, widths in ASSET_SOURCES:
+        matches = sorted(glob.glob(os.path.join(PUBLIC_DIR, pattern)))
+        if not matches:
+            print(f"\n[!] 没有找到源图: {pattern}")
+        for source_path in matches:
+            relative_path = Path(os.path.relpath(source_path, PUBLIC_DIR)).as_posix()
+            assets[to_url(relative_path)] = build_asset(relative_path, widths, formats, output_dir)
+
+    manifest = build_manifest(assets)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="网页图片资源构建工具")
+    parser.add_argument('--formats', nargs='+', choices=list(OUTPUT_FORMATS), default=list(OUTPUT_FORMATS),
+                        help="要生成的格式（默认 avif webp）")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+    print("\n" + "=" * 80)
+    print("网页图片资源构建工具")
+    print("=" * 80)
+
+    manifest = build_assets(args.formats)
+
+    source_bytes = sum(entry['bytes'] for entry in manifest['assets'].values())
+    print("\n" + "=" * 80)
+    print(f"  源图: {len(manifest['assets'])} 张，共 {compress_images.format_size(source_bytes)}")
+    for fmt in args.formats:
+        variants = [
+            variant
+            for entry in manifest['assets'].values()
+            for variant in entry['variants']
+            if variant['format'] == fmt
+        ]
+        if variants:
+            total = sum(variant['bytes'] for variant in variants)
+            print(f"  {fmt.upper()}: {len(variants)} 个文件，共 {compress_images.format_size(total)}")
+    print(f"  清单: {os.path.join(PUBLIC_DIR, OUTPUT_SUBDIR, MANIFEST_NAME)}")
+    print("=" * 80 + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,20 @@
 将指定目录下所有大于3MB的图片压缩到3MB以下
 """
 
+import argparse
+import hashlib
+import io
+import json
+import math
 import os
+import queue
+import sqlite3
 import sys
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from PIL import Image
 
@@ -16,14 +28,53 @@ TARGET_SIZE_MB = 3
 TARGET_SIZE_BYTES = TARGET_SIZE_MB * 1024 * 1024
 SUPPORTED_FORMATS = ['.jpg', '.jpeg', '.png']
 
+# 质量档位：从 95 到 60，每档相差 5（二分查找，不再逐档尝试）
+QUALITY_STEPS = list(range(95, 59, -5))
+
+# 并行模式：同时解码的图片所占内存上限
+MEMORY_BUDGET_MB = 2048
+# 解码内存估算：解码后的像素 + 转换后的 RGB 副本 + 编码缓冲，每像素约 8 字节
+DECODE_BYTES_PER_PIXEL = 8
+
+# 扫描线程与压缩之间的待处理队列长度（发现的文件最多积压这么多个）
+PLAN_QUEUE_SIZE = 256
+# 试运行估算：压缩后的大小约为大小限制的该比例（质量按 5 档递减，结果通常略低于限制）
+ESTIMATED_FILL_RATIO = 0.92
+
+# 压缩结果：是否成功, 原始大小, 压缩后大小, 最终质量, 估算峰值内存（字节，未知时为 0），
+# 质量尝试次数, 各阶段耗时（秒）, 错误信息
+CompressResult = namedtuple(
+    'CompressResult',
+    ['success', 'original_size', 'compressed_size', 'quality', 'peak_memory',
+     'attempts', 'timings', 'error'],
+    defaults=[0, 0, None, None]
+)
+FAILED_RESULT = CompressResult(False, 0, 0, 0)
+
+# 压缩缓存：记录已处理的文件，以及相同内容图片的压缩结果
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compress_cache.sqlite3')
+
 # 统计信息
 stats = {
     'total': 0,
     'compressed': 0,
     'skipped': 0,
+    'cached': 0,
     'failed': 0
 }
 
+# 运行报告：逐文件耗时和各阶段耗时汇总，可选输出 JSON-lines 事件流
+SLOWEST_FILES = 10
+report = {
+    'verbose': True,    # 是否逐文件打印
+    'events': None,     # JSON-lines 事件输出文件
+    'durations': [],    # (耗时秒, 文件路径)
+    'phases': {},       # 阶段 -> 累计耗时秒
+    'attempts': 0,
+    'bytes_in': 0,
+    'bytes_out': 0,
+}
+
 
 def get_file_size(file_path):
     """获取文件大小（字节）"""
@@ -40,133 +91,760 @@ def format_size(size_bytes):
         return f"{size_bytes / (1024 * 1024):.2f} MB"
 
 
-def compress_image(file_path):
+def encode_jpeg(img, quality):
+    """在内存中把图片编码为 JPEG，返回字节数据（不写磁盘）"""
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def search_quality(img, target_bytes=TARGET_SIZE_BYTES, encode=None, steps=QUALITY_STEPS):
+    """
+    在质量档位 steps（从高到低）中二分查找满足大小限制的最高质量
+    8 档质量最多编码 3~4 次（原来逐档递减最多 8 次）
+    encode: 编码函数 encode(img, quality) -> bytes，默认为 JPEG
+    返回：最终质量, 编码后的字节数据, 编码次数；最低质量仍超限时返回最低质量的结果
+    """
+    if encode is None:
+        encode = encode_jpeg
+    low, high = 0, len(steps) - 1
+    best = None
+    attempts = 0
+
+    while low <= high:
+        mid = (low + high) // 2
+        quality = steps[mid]
+        data = encode(img, quality)
+        attempts += 1
+
+        if len(data) <= target_bytes:
+            # 满足要求，继续尝试更高的质量
+            best = (quality, data)
+            high = mid - 1
+        else:
+            low = mid + 1
+
+    if best is None:
+        # 全部超限时最后一次编码的就是最低质量（这是我们能做的最好结果）
+        best = (quality, data)
+
+    return best + (attempts,)
+
+
+def output_path_for(file_path):
+    """压缩后的文件路径：PNG 会改名为 .jpg，其它格式保持原路径"""
+    final_path = Path(file_path)
+    if final_path.suffix.lower() in ['.png']:
+        final_path = final_path.with_suffix('.jpg')
+    return str(final_path)
+
+
+def write_output(file_path, data):
+    """
+    把压缩结果一次性写入磁盘并替换原文件
+    返回最终文件路径
+    """
+    final_path = output_path_for(file_path)
+    # PNG 改名为 .jpg 时，不能覆盖已存在的同名文件
+    if final_path != file_path and os.path.exists(final_path):
+        raise FileExistsError(f"目标文件已存在: {final_path}")
+
+    temp_path = final_path + '.temp'
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, final_path)
+    finally:
+        # 清理临时文件
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    if final_path != file_path:
+        os.remove(file_path)
+
+    return final_path
+
+
+def image_memory(img):
+    """估算 Pillow 图像的像素缓冲大小（字节），多通道图像每像素占 4 字节"""
+    width, height = img.size
+    bytes_per_pixel = 1 if img.mode in ('1', 'L', 'P') else 4
+    return width * height * bytes_per_pixel
+
+
+def fit_size(size, max_dimension):
+    """按比例缩放，使最长边不超过 max_dimension"""
+    if max_dimension <= 0:
+        raise ValueError(f"最长边必须大于 0: {max_dimension}")
+    width, height = size
+    scale = max_dimension / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def load_image(file_path, max_dimension=None, timings=None):
+    """
+    解码图片并转换为可以保存为 JPEG 的模式
+    指定 max_dimension 时先缩小再进入质量查找：
+    JPEG 用 draft 在解码阶段按 1/2、1/4、1/8 缩小，其它格式解码后用 reduce 缩小
+    timings: 可选，记录 decode / resize / convert 各阶段耗时的字典
+    返回：图片, 估算峰值内存（字节）
+    """
+    if max_dimension is not None and max_dimension <= 0:
+        raise ValueError(f"最长边必须大于 0: {max_dimension}")
+    if timings is None:
+        timings = {}
+    start = time.perf_counter()
+    img = Image.open(file_path)
+    resize = max_dimension and max(img.size) > max_dimension
+    if resize:
+        # 只对 JPEG 生效：按 DCT 缩放解码，不分配原尺寸的像素缓冲
+        img.draft('RGB', fit_size(img.size, max_dimension))
+    img.load()
+    peak = image_memory(img)
+    timings['decode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if resize and max(img.size) > max_dimension:
+        # reducing_gap 让 Pillow 先按整数倍 reduce，再做精确重采样
+        resized = img.resize(fit_size(img.size, max_dimension), Image.LANCZOS, reducing_gap=3.0)
+        peak = max(peak, image_memory(img) + image_memory(resized))
+        img.close()
+        img = resized
+    timings['resize'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # 如果是 RGBA 模式的 PNG，需要转换为 RGB
+    if img.mode == 'RGBA':
+        # 创建白色背景
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        # 直接用 RGBA 图片作为掩码，不再用 split() 复制出完整的 alpha 通道
+        background.paste(img, mask=img)
+        peak = max(peak, image_memory(img) + image_memory(background))
+        img.close()
+        img = background
+    elif img.mode not in ('RGB', 'L'):
+        converted = img.convert('RGB')
+        peak = max(peak, image_memory(img) + image_memory(converted))
+        img.close()
+        img = converted
+    timings['convert'] = time.perf_counter() - start
+
+    return img, peak
+
+
+def compress_image(file_path, max_dimension=None):
     """
     压缩图片到目标大小以下
-    返回：是否成功, 原始大小, 压缩后大小, 最终质量
+    max_dimension: 可选，先把最长边缩小到该像素数
+    返回：CompressResult（含各阶段耗时和质量尝试次数）
     """
+    timings = {}
     try:
-        # 读取图片
-        img = Image.open(file_path)
         original_size = get_file_size(file_path)
+        img, peak = load_image(file_path, max_dimension, timings)
 
-        # 如果是 RGBA 模式的 PNG，需要转换为 RGB
-        if img.mode == 'RGBA':
-            # 创建白色背景
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            # 粘贴图片（使用 alpha 通道作为掩码）
-            background.paste(img, mask=img.split()[3])
-            img = background
-        elif img.mode not in ('RGB', 'L'):
-            img = img.convert('RGB')
-
-        # 临时文件路径
-        temp_path = file_path + '.temp'
-
-        # 逐步降低质量，从95开始，每次递减5，最低到60
-        quality = 95
-        min_quality = 60
-
-        while quality >= min_quality:
-            # 保存为 JPEG 格式
-            img.save(temp_path, 'JPEG', quality=quality, optimize=True)
-
-            # 检查文件大小
-            compressed_size = get_file_size(temp_path)
-
-            if compressed_size <= TARGET_SIZE_BYTES:
-                # 压缩成功，替换原文件
-                os.remove(file_path)
-                os.rename(temp_path, file_path)
-
-                # 保持原来的扩展名
-                final_path = Path(file_path)
-                if final_path.suffix.lower() in ['.png']:
-                    # 如果原文件是 PNG，改名为 .jpg
-                    new_path = str(final_path.with_suffix('.jpg'))
-                    os.rename(file_path, new_path)
-                    file_path = new_path
-
-                return True, original_size, compressed_size, quality
-
-            # 质量太高，继续降低
-            quality -= 5
-
-        # 如果质量降到最低仍无法满足要求，使用最低质量
-        img.save(temp_path, 'JPEG', quality=min_quality, optimize=True)
-        compressed_size = get_file_size(temp_path)
-
-        if compressed_size <= TARGET_SIZE_BYTES:
-            os.remove(file_path)
-            os.rename(temp_path, file_path)
-
-            # 保持原来的扩展名
-            final_path = Path(file_path)
-            if final_path.suffix.lower() in ['.png']:
-                new_path = str(final_path.with_suffix('.jpg'))
-                os.rename(file_path, new_path)
-                file_path = new_path
-
-            return True, original_size, compressed_size, min_quality
-        else:
-            # 即使降到最低质量也无法满足要求，仍然替换（这是我们能做的最好结果）
-            os.remove(file_path)
-            os.rename(temp_path, file_path)
+        # 在内存中查找合适的质量，只把最终结果写入磁盘
+        start = time.perf_counter()
+        with img:
+            quality, data, attempts = search_quality(img)
+            # 质量查找时同时保留当前结果和最优结果两个编码缓冲
+            peak = max(peak, image_memory(img) + 2 * len(data))
+        timings['encode'] = time.perf_counter() - start
 
-            final_path = Path(file_path)
-            if final_path.suffix.lower() in ['.png']:
-                new_path = str(final_path.with_suffix('.jpg'))
-                os.rename(file_path, new_path)
-                file_path = new_path
+        start = time.perf_counter()
+        write_output(file_path, data)
+        timings['write'] = time.perf_counter() - start
 
-            return True, original_size, compressed_size, min_quality
+        return CompressResult(True, original_size, len(data), quality, peak, attempts, timings)
 
     except Exception as e:
-        print(f"  ❌ 错误: {e}")
-        # 清理临时文件
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        return False, 0, 0, 0
+        return FAILED_RESULT._replace(timings=timings, error=str(e))
+
+
+def open_cache(cache_path=CACHE_FILE):
+    """打开（或创建）压缩缓存数据库"""
+    cache = sqlite3.connect(cache_path)
+    cache.executescript("""
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS outputs (
+            sha256 TEXT NOT NULL,
+            max_dimension INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            quality INTEGER NOT NULL,
+            PRIMARY KEY (sha256, max_dimension)
+        );
+    """)
+    return cache
+
+
+def file_digest(file_path):
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_key(file_path):
+    """缓存中使用的规范化路径"""
+    return os.path.normcase(os.path.abspath(file_path))
+
+
+def cache_is_unchanged(cache, file_path, st):
+    """文件上次已处理过，且大小和修改时间都没有变化"""
+    row = cache.execute(
+        "SELECT size, mtime_ns FROM files WHERE path = ?", (_cache_key(file_path),)
+    ).fetchone()
+    return row is not None and row == (st.st_size, st.st_mtime_ns)
+
+
+def cache_reuse_output(cache, file_path, digest, max_dimension=None):
+    """
+    内容相同的图片已用相同设置压缩过时，直接复制之前的压缩结果，不再解码和编码
+    返回：(压缩结果, 来源路径)；没有可用的结果时返回 None
+    """
+    row = cache.execute(
+        "SELECT path, quality FROM outputs WHERE sha256 = ? AND max_dimension = ?",
+        (digest, max_dimension or 0)
+    ).fetchone()
+    if row is None:
+        return None
+
+    source, quality = row
+    try:
+        # 之前的压缩结果被修改或删除后不能再复用
+        if not cache_is_unchanged(cache, source, os.stat(source)):
+            return None
+        with open(source, 'rb') as f:
+            data = f.read()
+        original_size = get_file_size(file_path)
+        write_output(file_path, data)
+    except OSError:
+        return None
+
+    return CompressResult(True, original_size, len(data), quality), source
+
+
+def cache_store(cache, file_path, digest, quality, max_dimension=None):
+    """记录压缩结果：输出文件的路径+大小+修改时间，以及原图内容哈希对应的输出"""
+    output_path = output_path_for(file_path)
+    st = os.stat(output_path)
+    key = _cache_key(output_path)
 
+    cache.execute(
+        "INSERT OR REPLACE INTO files (path, size, mtime_ns) VALUES (?, ?, ?)",
+        (key, st.st_size, st.st_mtime_ns)
+    )
+    cache.execute(
+        "INSERT OR REPLACE INTO outputs (sha256, max_dimension, path, quality) VALUES (?, ?, ?, ?)",
+        (digest, max_dimension or 0, key, quality)
+    )
+    # 每个文件处理完立即提交，中断后重新运行可以从中断处继续
+    cache.commit()
 
-def scan_directory(directory):
+
+def scan_images(directory):
+    """
+    用 scandir 递归遍历目录，依次返回 (图片路径, stat 结果)
+    直接复用 scandir 返回的 stat 信息，不再对每个文件单独调用 getsize；
+    顺序与 os.walk 相同：先当前目录的文件，再依次进入子目录
+    """
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        # 与 os.walk 一致，无法读取的目录直接跳过
+        return
+
+    subdirs = []
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in SUPPORTED_FORMATS:
+                yield entry.path, entry.stat()
+        except OSError:
+            continue
+
+    for subdir in subdirs:
+        yield from scan_images(subdir)
+
+
+def iter_images(directory):
+    """递归遍历目录，依次返回支持格式的图片路径"""
+    for file_path, st in scan_images(directory):
+        yield file_path
+
+
+def plan_images(directory, queue_size=PLAN_QUEUE_SIZE):
+    """
+    在后台线程中扫描目录，通过有界队列依次返回 (图片路径, stat 结果)
+    扫描（在网络盘上可能很慢）与压缩同时进行；队列满时扫描线程等待，内存占用有上限
+    """
+    work = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                work.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in scan_images(directory):
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    thread = threading.Thread(target=producer, name='compress-planner', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = work.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # 提前结束（例如出错或 Ctrl+C）时通知扫描线程退出
+        stop.set()
+        thread.join()
+
+
+def estimate_output_size(file_size):
+    """试运行时估算压缩后的大小，不解码图片"""
+    if file_size <= TARGET_SIZE_BYTES:
+        return file_size
+    return int(TARGET_SIZE_BYTES * ESTIMATED_FILL_RATIO)
+
+
+def plan_directory(directory, cache=None):
+    """
+    试运行：只扫描目录，不解码也不修改任何文件
+    返回：文件数、超过大小限制的文件数及总大小、估算的压缩后总大小
+    """
+    plan = {
+        'files': 0,
+        'total_bytes': 0,
+        'over_limit': 0,
+        'over_limit_bytes': 0,
+        'cached': 0,
+        'estimated_bytes': 0,
+    }
+    for file_path, st in scan_images(directory):
+        plan['files'] += 1
+        plan['total_bytes'] += st.st_size
+
+        if st.st_size > TARGET_SIZE_BYTES:
+            if cache is not None and cache_is_unchanged(cache, file_path, st):
+                # 上次已处理过，本次会直接跳过
+                plan['cached'] += 1
+                plan['estimated_bytes'] += st.st_size
+                continue
+            plan['over_limit'] += 1
+            plan['over_limit_bytes'] += st.st_size
+        plan['estimated_bytes'] += estimate_output_size(st.st_size)
+
+    return plan
+
+
+def print_plan(plan):
+    """显示试运行结果"""
+    saved = plan['total_bytes'] - plan['estimated_bytes']
+    print(f"  图片总数: {plan['files']}（{format_size(plan['total_bytes'])}）")
+    print(f"  超过 {TARGET_SIZE_MB}MB: {plan['over_limit']}（{format_size(plan['over_limit_bytes'])}）")
+    print(f"  缓存跳过: {plan['cached']}")
+    print(f"  估算压缩后总大小: {format_size(plan['estimated_bytes'])}（约节省 {format_size(saved)}）")
+
+
+def estimate_decode_memory(file_path, max_dimension=None):
+    """估算解码图片所需内存（字节），只读取文件头，不解码像素"""
+    try:
+        with Image.open(file_path) as img:
+            if max_dimension and max(img.size) > max_dimension:
+                # JPEG 的 draft 只修改解码尺寸，此时还没有解码
+                img.draft('RGB', fit_size(img.size, max_dimension))
+            width, height = img.size
+    except Exception:
+        return 0
+    return width * height * DECODE_BYTES_PER_PIXEL
+
+
+def log(message):
+    """逐文件的输出，关闭 verbose 时不打印（大批量运行时 print 本身也有开销）"""
+    if report['verbose']:
+        print(message)
+
+
+def emit_event(event):
+    """向 JSON-lines 事件流写入一条记录"""
+    if report['events'] is not None:
+        report['events'].write(json.dumps(event, ensure_ascii=False) + '\n')
+
+
+def print_file_header(index, file_path, file_size):
+    """显示文件信息"""
+    log(f"\n[{index}] {os.path.basename(file_path)}")
+    log(f"  大小: {format_size(file_size)}")
+
+
+def record_result(result):
+    """更新统计信息并显示压缩结果"""
+    if result.success:
+        stats['compressed'] += 1
+        # 质量为 0 表示未知（子进程写完结果后异常退出）
+        details = [f"质量: {result.quality}"] if result.quality else []
+        if result.peak_memory:
+            details.append(f"峰值内存: {format_size(result.peak_memory)}")
+        details = f" ({', '.join(details)})" if details else ""
+        log(f"  [OK] 压缩成功: {format_size(result.original_size)} -> {format_size(result.compressed_size)}{details}")
+    else:
+        stats['failed'] += 1
+        if result.error:
+            log(f"  ❌ 错误: {result.error}")
+        log(f"  [FAIL] 压缩失败")
+
+
+def record_file(index, file_path, file_size, status, result=None, seconds=0.0):
+    """
+    记录单个文件的耗时并输出 JSON-lines 事件
+    status: skipped / cached / reused / compressed / failed
+    """
+    event = {
+        'event': 'file',
+        'index': index,
+        'path': file_path,
+        'status': status,
+        'bytes_in': file_size,
+        'seconds': round(seconds, 6),
+    }
+    if result is not None:
+        timings = result.timings or {}
+        event.update({
+            'bytes_out': result.compressed_size,
+            'quality': result.quality,
+            'attempts': result.attempts,
+            'peak_memory': result.peak_memory,
+            'timings': {phase: round(value, 6) for phase, value in timings.items()},
+        })
+        if result.error:
+            event['error'] = result.error
+
+        report['attempts'] += result.attempts
+        for phase, value in timings.items():
+            report['phases'][phase] = report['phases'].get(phase, 0.0) + value
+        if result.success:
+            report['bytes_in'] += file_size
+            report['bytes_out'] += result.compressed_size
+
+    if status != 'skipped':
+        report['durations'].append((seconds, file_path))
+    emit_event(event)
+
+
+def prepare_file(file_path, file_size, st, cache, max_dimension=None):
+    """
+    压缩前的检查，不解码图片
+    返回：(处理方式, 附加信息)
+      'skip'     已小于大小限制，无需压缩
+      'cached'   上次已处理过且文件没有变化
+      'reused'   已复用内容相同图片的压缩结果，附加信息为 (压缩结果, 来源路径, 原图内容哈希)
+      'compress' 需要压缩，附加信息为原图内容哈希（未启用缓存时为 None）
+    """
+    if file_size <= TARGET_SIZE_BYTES:
+        return 'skip', None
+    if cache is None:
+        return 'compress', None
+    if cache_is_unchanged(cache, file_path, st):
+        return 'cached', None
+
+    digest = file_digest(file_path)
+    reused = cache_reuse_output(cache, file_path, digest, max_dimension)
+    if reused is not None:
+        return 'reused', reused + (digest,)
+    return 'compress', digest
+
+
+def report_prepared(index, file_path, file_size, kind, info, seconds, cache=None, max_dimension=None):
+    """显示并记录不需要重新编码的文件，复用的压缩结果同样写入缓存"""
+    if kind == 'skip':
+        log(f"  [OK] 无需压缩（已小于 {TARGET_SIZE_MB}MB）")
+        stats['skipped'] += 1
+        record_file(index, file_path, file_size, 'skipped', seconds=seconds)
+    elif kind == 'cached':
+        log(f"  [OK] 上次已处理且文件未变化，跳过")
+        stats['cached'] += 1
+        record_file(index, file_path, file_size, 'cached', seconds=seconds)
+    elif kind == 'reused':
+        result, source, digest = info
+        log(f"  [!] 超过 {TARGET_SIZE_MB}MB，复用相同图片的压缩结果: {source}")
+        record_result(result)
+        record_file(index, file_path, file_size, 'reused', result, seconds)
+        cache_store(cache, file_path, digest, result.quality, max_dimension)
+
+
+def finish_compress(index, file_path, file_size, cache, digest, result, seconds, max_dimension=None):
+    """显示压缩结果，记录耗时，成功后写入缓存"""
+    record_result(result)
+    seconds += sum((result.timings or {}).values())
+    record_file(index, file_path, file_size, 'compressed' if result.success else 'failed', result, seconds)
+    if cache is not None and result.success:
+        cache_store(cache, file_path, digest, result.quality, max_dimension)
+
+
+def scan_directory(directory, workers=1, memory_budget_mb=MEMORY_BUDGET_MB, cache=None,
+                   max_dimension=None):
     """递归扫描目录，处理所有图片"""
+    if workers > 1:
+        scan_directory_parallel(directory, workers, memory_budget_mb, cache, max_dimension)
+        return
+
     print(f"\n扫描目录: {directory}")
     print("=" * 80)
 
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            file_path = os.path.join(root, file)
-            file_ext = os.path.splitext(file)[1].lower()
+    for file_path, st in plan_images(directory):
+        stats['total'] += 1
+        start = time.perf_counter()
+        file_size = st.st_size
+
+        print_file_header(stats['total'], file_path, file_size)
+
+        # 检查是否需要压缩
+        kind, info = prepare_file(file_path, file_size, st, cache, max_dimension)
+        seconds = time.perf_counter() - start
+        if kind == 'compress':
+            log(f"  [!] 超过 {TARGET_SIZE_MB}MB，开始压缩...")
+            result = compress_image(file_path, max_dimension)
+            finish_compress(stats['total'], file_path, file_size, cache, info, result, seconds, max_dimension)
+        else:
+            report_prepared(stats['total'], file_path, file_size, kind, info, seconds, cache, max_dimension)
 
-            # 只处理支持的图片格式
-            if file_ext in SUPPORTED_FORMATS:
-                stats['total'] += 1
-                file_size = get_file_size(file_path)
 
-                # 显示文件信息
-                print(f"\n[{stats['total']}] {file}")
-                print(f"  大小: {format_size(file_size)}")
+def _submit(pool, file_path, max_dimension=None):
+    """提交压缩任务；子进程被杀（例如内存不足）后进程池不能再用，换一个新的进程池再提交"""
+    try:
+        future = pool['executor'].submit(compress_image, file_path, max_dimension)
+    except BrokenProcessPool:
+        log("  [!] 子进程异常退出，重新创建进程池")
+        pool['executor'].shutdown()
+        pool['executor'] = ProcessPoolExecutor(max_workers=pool['workers'])
+        future = pool['executor'].submit(compress_image, file_path, max_dimension)
+    pool['in_flight'][future] = pool['costs'][file_path]
+    return future
 
-                # 检查是否需要压缩
-                if file_size > TARGET_SIZE_BYTES:
-                    print(f"  [!] 超过 {TARGET_SIZE_MB}MB，开始压缩...")
 
-                    success, original_size, compressed_size, quality = compress_image(file_path)
+def _written_result(file_path, scanned):
+    """
+    进程池损坏时，子进程可能已写完结果但还没来得及返回
+    原图仍是扫描时的样子则返回 None（需要重新压缩），否则按磁盘上的输出文件返回 CompressResult
+    """
+    try:
+        st = os.stat(file_path)
+        if (st.st_size, st.st_mtime_ns) == scanned and st.st_size > TARGET_SIZE_BYTES:
+            return None
+    except OSError:
+        pass
 
-                    if success:
-                        stats['compressed'] += 1
-                        print(f"  [OK] 压缩成功: {format_size(original_size)} -> {format_size(compressed_size)} (质量: {quality})")
-                    else:
-                        stats['failed'] += 1
-                        print(f"  [FAIL] 压缩失败")
-                else:
-                    print(f"  [OK] 无需压缩（已小于 {TARGET_SIZE_MB}MB）")
-                    stats['skipped'] += 1
+    output_path = output_path_for(file_path)
+    try:
+        output_size = os.stat(output_path).st_size
+    except OSError as e:
+        return FAILED_RESULT._replace(error=str(e))
+    # 子进程没有返回使用的质量，记为 0（未知）
+    return CompressResult(True, scanned[0], output_size, 0)
+
+
+def _flush_ready(pending, pool, cache, max_dimension=None, block=False):
+    """
+    按扫描顺序输出已完成的结果；block=True 时等待全部完成
+    进程池损坏时排队中的任务都会失败：已写完结果的按磁盘上的输出记录，其余在新进程池中重试一次
+    """
+    while pending:
+        index, file_path, file_size, kind, info, seconds, future = pending[0]
+        if future is None:
+            pending.popleft()
+            print_file_header(index, file_path, file_size)
+            report_prepared(index, file_path, file_size, kind, info, seconds, cache, max_dimension)
+            continue
+        if not future.done() and not block:
+            return
+
+        try:
+            result = future.result()
+        except BrokenProcessPool as e:
+            result = _written_result(file_path, pool['scanned'][file_path])
+            if result is None and file_path not in pool['retried']:
+                pool['retried'].add(file_path)
+                pending[0] = (index, file_path, file_size, kind, info, seconds,
+                              _submit(pool, file_path, max_dimension))
+                continue
+            if result is None:
+                result = FAILED_RESULT._replace(error=str(e))
+        except Exception as e:
+            result = FAILED_RESULT._replace(error=str(e))
+        pending.popleft()
+
+        print_file_header(index, file_path, file_size)
+        log(f"  [!] 超过 {TARGET_SIZE_MB}MB，开始压缩...")
+        finish_compress(index, file_path, file_size, cache, info, result, seconds, max_dimension)
+
+
+def scan_directory_parallel(directory, workers, memory_budget_mb=MEMORY_BUDGET_MB, cache=None,
+                            max_dimension=None):
+    """
+    使用进程池并行压缩图片
+    统计信息和缓存只在主进程中更新，输出顺序与扫描顺序一致；
+    同时解码的图片估算内存总和不超过 memory_budget_mb
+    """
+    if memory_budget_mb <= 0:
+        raise ValueError(f"内存上限必须大于 0: {memory_budget_mb}")
+    print(f"\n扫描目录: {directory}（并行进程数: {workers}，内存上限: {memory_budget_mb}MB）")
+    print("=" * 80)
+
+    memory_budget = memory_budget_mb * 1024 * 1024
+    # 等待按顺序输出的文件：(序号, 文件路径, 文件大小, 处理方式, 附加信息, 检查耗时, future)
+    pending = deque()
+    # 进程池状态：正在压缩的任务及其估算内存、各文件的估算内存和扫描时的 (大小, 修改时间)、已重试过的文件
+    pool = {
+        'executor': ProcessPoolExecutor(max_workers=workers),
+        'workers': workers,
+        'in_flight': {},
+        'costs': {},
+        'scanned': {},
+        'retried': set(),
+    }
+    in_flight = pool['in_flight']
+
+    try:
+        for file_path, st in plan_images(directory):
+            stats['total'] += 1
+            start = time.perf_counter()
+            file_size = st.st_size
+            kind, info = prepare_file(file_path, file_size, st, cache, max_dimension)
+            seconds = time.perf_counter() - start
+            future = None
+
+            if kind == 'compress':
+                # 单张图片超过上限时也允许独占运行，避免永远无法提交
+                cost = min(estimate_decode_memory(file_path, max_dimension), memory_budget)
+                while True:
+                    for finished in [f for f in in_flight if f.done()]:
+                        del in_flight[finished]
+                    if not in_flight or sum(in_flight.values()) + cost <= memory_budget:
+                        break
+                    wait(in_flight, return_when=FIRST_COMPLETED)
+                    _flush_ready(pending, pool, cache, max_dimension)
+
+                pool['costs'][file_path] = cost
+                pool['scanned'][file_path] = (st.st_size, st.st_mtime_ns)
+                future = _submit(pool, file_path, max_dimension)
+
+            pending.append((stats['total'], file_path, file_size, kind, info, seconds, future))
+            _flush_ready(pending, pool, cache, max_dimension)
+
+        _flush_ready(pending, pool, cache, max_dimension, block=True)
+    finally:
+        pool['executor'].shutdown()
+
+
+def percentile(values, pct):
+    """最近秩法计算百分位数，values 需已排序"""
+    rank = max(0, math.ceil(pct / 100 * len(values)) - 1)
+    return values[rank]
+
+
+def summarize_run(seconds):
+    """汇总本次运行：耗时分位数、最慢的文件、各阶段累计耗时"""
+    durations = sorted(report['durations'])
+    values = [duration for duration, path in durations]
+    summary = {
+        'event': 'summary',
+        'seconds': round(seconds, 6),
+        'stats': dict(stats),
+        'attempts': report['attempts'],
+        'bytes_in': report['bytes_in'],
+        'bytes_out': report['bytes_out'],
+        'phases': {phase: round(value, 6) for phase, value in report['phases'].items()},
+        'latency': {},
+        'slowest': [
+            {'path': path, 'seconds': round(duration, 6)}
+            for duration, path in reversed(durations[-SLOWEST_FILES:])
+        ],
+    }
+    if values:
+        summary['latency'] = {
+            f'p{pct}': round(percentile(values, pct), 6) for pct in (50, 90, 99)
+        }
+        summary['latency']['max'] = round(values[-1], 6)
+    return summary
+
+
+def print_summary(summary):
+    """显示耗时统计"""
+    print(f"  总耗时: {summary['seconds']:.2f} 秒")
+    if summary['latency']:
+        latency = summary['latency']
+        print(f"  单文件耗时: p50 {latency['p50']:.3f}s / p90 {latency['p90']:.3f}s / "
+              f"p99 {latency['p99']:.3f}s / 最长 {latency['max']:.3f}s")
+    if summary['phases']:
+        phases = ", ".join(f"{phase} {value:.2f}s" for phase, value in summary['phases'].items())
+        print(f"  各阶段累计: {phases}")
+        print(f"  质量尝试次数: {summary['attempts']}")
+    if summary['slowest']:
+        print(f"  最慢的 {len(summary['slowest'])} 个文件:")
+        for item in summary['slowest']:
+            print(f"    {item['seconds']:.3f}s  {item['path']}")
+
+
+def positive_int(value):
+    """命令行参数：正整数"""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"必须是正整数: {value}")
+    return number
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="图片批量压缩工具")
+    parser.add_argument('--workers', type=positive_int, default=1,
+                        help="并行压缩的进程数（默认 1，即逐个压缩）")
+    parser.add_argument('--memory-budget', type=positive_int, default=MEMORY_BUDGET_MB,
+                        help=f"并行模式下同时解码图片的内存上限，单位 MB（默认 {MEMORY_BUDGET_MB}）")
+    parser.add_argument('--max-dimension', type=positive_int, default=None,
+                        help="压缩时把图片最长边缩小到该像素数（默认不缩放）")
+    parser.add_argument('--cache', default=CACHE_FILE,
+                        help="压缩缓存数据库路径（默认与脚本同目录的 compress_cache.sqlite3）")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="不使用压缩缓存，所有超限图片都重新压缩")
+    parser.add_argument('--events', default=None,
+                        help="把逐文件耗时和运行汇总写入该 JSON-lines 文件")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="试运行：只扫描并估算可节省的空间，不解码、不修改任何文件")
+    parser.add_argument('--quiet', action='store_true',
+                        help="不逐文件打印，只显示最终统计")
+    return parser.parse_args()
 
 
 def main():
-    import io
+    args = parse_args()
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
     print("\n" + "=" * 80)
@@ -176,12 +854,27 @@ def main():
     print(f"  - 目标目录: {TARGET_DIR}")
     print(f"  - 大小限制: {TARGET_SIZE_MB}MB")
     print(f"  - 支持格式: {', '.join(SUPPORTED_FORMATS)}")
+    if args.max_dimension:
+        print(f"  - 最长边: {args.max_dimension}px")
+    if args.workers > 1:
+        print(f"  - 并行进程: {args.workers}（内存上限 {args.memory_budget}MB）")
 
     # 检查目录是否存在
     if not os.path.exists(TARGET_DIR):
         print(f"\n[错误] 目录不存在 - {TARGET_DIR}")
         sys.exit(1)
 
+    if args.dry_run:
+        cache = None if args.no_cache or not os.path.exists(args.cache) else open_cache(args.cache)
+        print(f"\n试运行（不会修改任何文件）: {TARGET_DIR}")
+        print("=" * 80)
+        plan = plan_directory(TARGET_DIR, cache)
+        if cache is not None:
+            cache.close()
+        print_plan(plan)
+        print("=" * 80 + "\n")
+        sys.exit(0)
+
     # 询问是否继续
     print(f"\n[警告] 压缩会覆盖原文件，建议先备份整个文件夹！")
     response = input("\n是否继续？(输入 yes 继续): ")
@@ -191,7 +884,31 @@ def main():
         sys.exit(0)
 
     # 开始扫描和压缩
-    scan_directory(TARGET_DIR)
+    report['verbose'] = not args.quiet
+    if args.events:
+        report['events'] = open(args.events, 'a', encoding='utf-8')
+    emit_event({
+        'event': 'start',
+        'directory': TARGET_DIR,
+        'target_bytes': TARGET_SIZE_BYTES,
+        'workers': args.workers,
+        'max_dimension': args.max_dimension,
+        'cache': None if args.no_cache else args.cache,
+        'time': time.time(),
+    })
+
+    cache = None if args.no_cache else open_cache(args.cache)
+    start = time.perf_counter()
+    try:
+        scan_directory(TARGET_DIR, workers=args.workers, memory_budget_mb=args.memory_budget, cache=cache,
+                       max_dimension=args.max_dimension)
+    finally:
+        if cache is not None:
+            cache.close()
+    summary = summarize_run(time.perf_counter() - start)
+    emit_event(summary)
+    if report['events'] is not None:
+        report['events'].close()
 
     # 显示统计信息
     print("\n" + "=" * 80)
@@ -200,7 +917,9 @@ def main():
     print(f"  总文件数: {stats['total']}")
     print(f"  已压缩: {stats['compressed']}")
     print(f"  无需压缩: {stats['skipped']}")
+    print(f"  缓存跳过: {stats['cached']}")
     print(f"  压缩失败: {stats['failed']}")
+    print_summary(summary)
     print("=" * 80 + "\n")
 
 
@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+埋点数据转列式存储工具
+流式读取 Mixpanel 导出的 events-export-*.json 和应用导出的 import-records.json，
+展开事件属性后分批写入 Parquet（或 Arrow IPC 流），字符串列使用字典编码；
+转换时同时生成按天汇总（日活、练习时长），也可以只读取需要的列做查询
+
+用法:
+  python convert_events_to_parquet.py convert events-export-3981775-1768969634638.json
+  python convert_events_to_parquet.py convert import-records.json --format arrow
+  python convert_events_to_parquet.py query events-export-3981775-1768969634638.parquet dau
+  python convert_events_to_parquet.py query import-records.parquet practice
+  python convert_events_to_parquet.py selfcheck
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# 配置参数
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INPUTS = ['events-export-*.json', 'import-records.json']
+# 按天汇总文件的后缀（与输出文件同名），默认输入中需要排除
+DAILY_SUFFIX = '.daily.json'
+# 每批写入的行数
+BATCH_ROWS = 10000
+# 每次从 JSON 文件读取的字符数
+JSON_CHUNK_SIZE = 64 * 1024
+# 可能出现在 JSON 数字中的字符
+NUMBER_CHARS = frozenset('0123456789.eE+-')
+# 按天统计使用北京时间
+DAY_TIMEZONE = timezone(timedelta(hours=8))
+# 记录练习时长的自定义事件（见 app/practice/page.tsx 中的 trackEvent）
+PRACTICE_EVENTS = ('finish_practice', 'add_record')
+# 补卡事件：练习日期是属性中的 date，而不是事件发生的日期
+BACKFILL_EVENT = 'add_record'
+
+# 输出格式：格式 -> 扩展名
+OUTPUT_FORMATS = {
+    'parquet': '.parquet',
+    'arrow': '.arrows',
+}
+
+DICT_STRING = pa.dictionary(pa.int32(), pa.string())
+
+# 直接映射为列的事件属性：列名 -> (属性名, 类型)
+EVENT_PROPERTY_COLUMNS = {
+    'distinct_id': ('distinct_id', DICT_STRING),
+    'device_id': ('$device_id', DICT_STRING),
+    'user_id': ('$user_id', DICT_STRING),
+    'browser': ('$browser', DICT_STRING),
+    'browser_version': ('$browser_version', DICT_STRING),
+    'os': ('$os', DICT_STRING),
+    'device': ('$device', DICT_STRING),
+    'country': ('mp_country_code', DICT_STRING),
+    'region': ('$region', DICT_STRING),
+    'city': ('$city', DICT_STRING),
+    'host': ('$host', DICT_STRING),
+    'pathname': ('$pathname', DICT_STRING),
+    'current_url': ('$current_url', DICT_STRING),
+    'insert_id': ('$insert_id', pa.string()),
+    'event_type': ('$event_type', DICT_STRING),
+    'el_tag_name': ('$el_tag_name', DICT_STRING),
+    'screen_width': ('$screen_width', pa.int32()),
+    'screen_height': ('$screen_height', pa.int32()),
+    'viewport_width': ('$viewportWidth', pa.int32()),
+    'viewport_height': ('$viewportHeight', pa.int32()),
+    'client_x': ('$clientX', pa.int32()),
+    'client_y': ('$clientY', pa.int32()),
+    'replay_id': ('$mp_replay_id', DICT_STRING),
+    'replay_length_ms': ('replay_length_ms', pa.int64()),
+    # 应用自定义事件的属性（lib/analytics.ts 的 trackEvent）
+    'practice_type': ('type', DICT_STRING),
+    'duration': ('duration', pa.int64()),
+    'is_patch': ('is_patch', pa.bool_()),
+    'uuid': ('uuid', DICT_STRING),
+}
+# 单独展开的嵌套属性，不再写入 extra
+FLATTENED_PROPERTIES = {'time', 'date', '$el_classes', '$elements', '$target'}
+
+EVENT_SCHEMA = pa.schema(
+    [
+        ('event', DICT_STRING),
+        ('time', pa.timestamp('ms', tz='UTC')),
+        ('date', pa.date32()),
+    ]
+    + [(name, value_type) for name, (prop, value_type) in EVENT_PROPERTY_COLUMNS.items()]
+    + [
+        ('record_date', pa.date32()),      # 补卡事件的练习日期（属性 date）
+        ('el_classes', pa.string()),       # 被点击元素的 class，空格分隔
+        ('element_path', pa.string()),     # $elements 的标签路径，例如 svg>button>div
+        ('element_count', pa.int16()),
+        ('extra', pa.string()),            # 其余属性，JSON 字符串
+    ]
+)
+
+RECORD_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('created_at', pa.timestamp('ms', tz='UTC')),
+    ('date', pa.date32()),
+    ('type', DICT_STRING),
+    ('duration', pa.int64()),
+    ('notes', pa.string()),
+    ('breakthrough', pa.string()),
+    ('photo_count', pa.int16()),
+])
+
+
+class _JsonReader:
+    """按块读取 JSON 文本，用 JSONDecoder.raw_decode 逐个解析值"""
+
+    def __init__(self, f, chunk_size=JSON_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """读取下一块，丢弃已解析的部分；文件结束时返回 False"""
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """跳过空白，返回下一个字符；文件结束时返回空字符串"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        """读取一个分隔符，必须是 chars 中的某个字符"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"JSON 格式错误：期望 {chars!r}，实际为 {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """解析下一个完整的 JSON 值"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # 值被块边界截断，继续读取
+                if not self._fill():
+                    raise
+                continue
+            # 块边界落在数字中间时 raw_decode 只解析出前半部分（例如 "12." 解析为 12），
+            # 之后到缓冲区末尾都是数字字符时继续读取再重新解析
+            if (isinstance(value, (int, float)) and not isinstance(value, bool)
+                    and all(char in NUMBER_CHARS for char in self.buffer[end:]) and self._fill()):
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_array(path, key=None, chunk_size=JSON_CHUNK_SIZE):
+    """
+    逐个返回 JSON 数组中的元素，不把整个文件载入内存
+    key: 数组位于顶层对象的某个字段中时指定字段名（如 import-records.json 的 records）
+    """
+    with open(path, encoding='utf-8-sig') as f:
+        reader = _JsonReader(f, chunk_size)
+
+        if key is not None:
+            reader.expect('{')
+            if reader.peek() == '}':
+                raise ValueError(f"没有找到字段: {key}")
+            while True:
+                name = reader.value()
+                reader.expect(':')
+                if name == key:
+                    break
+                # 跳过其它字段（options、profile 等都很小）
+                reader.value()
+                if reader.expect(',}') == '}':
+                    raise ValueError(f"没有找到字段: {key}")
+
+        reader.expect('[')
+        if reader.peek() == ']':
+            return
+        while True:
+            yield reader.value()
+            if reader.expect(',]') == ']':
+                return
+
+
+def detect_kind(path):
+    """根据顶层结构判断文件类型：数组为事件导出，对象为练习记录导出"""
+    with open(path, encoding='utf-8-sig') as f:
+        char = _JsonReader(f).peek()
+    if char == '[':
+        return 'events'
+    if char == '{':
+        return 'records'
+    raise ValueError(f"无法识别的文件: {path}")
+
+
+def _coerce(value, value_type):
+    """把属性值转换为列的类型，无法转换时为空"""
+    if value is None:
+        return None
+    try:
+        if value_type == DICT_STRING or value_type == pa.string():
+            return value if isinstance(value, str) else str(value)
+        if value_type == pa.bool_():
+            return bool(value)
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def local_date(timestamp):
+    """Unix 时间戳（秒）对应的北京时间日期"""
+    return datetime.fromtimestamp(timestamp, DAY_TIMEZONE).date()
+
+
+def parse_date(value):
+    """YYYY-MM-DD 字符串转为日期，无法解析时为空"""
+    try:
+        return date.fromisoformat(value[:10])
+    except (TypeError, ValueError):
+        return None
+
+
+def practice_day(event, day, record_date):
+    """练习事件计入的日期：补卡事件按补卡的日期，其它事件按发生日期"""
+    if event == BACKFILL_EVENT and record_date is not None:
+        return record_date
+    return day
+
+
+def flatten_event(event):
+    """把一条 Mixpanel 事件展开为一行（列名 -> 值）"""
+    properties = event.get('properties') or {}
+    timestamp = properties.get('time')
+
+    row = {
+        'event': event.get('event'),
+        'time': int(timestamp * 1000) if timestamp is not None else None,
+        'date': local_date(timestamp) if timestamp is not None else None,
+    }
+    for name, (prop, value_type) in EVENT_PROPERTY_COLUMNS.items():
+        row[name] = _coerce(properties.get(prop), value_type)
+    row['record_date'] = parse_date(properties.get('date'))
+
+    classes = properties.get('$el_classes')
+    row['el_classes'] = ' '.join(classes) if classes else None
+    elements = properties.get('$elements') or []
+    row['element_path'] = '>'.join(element.get('$tag_name', '') for element in elements) or None
+    row['element_count'] = len(elements) if elements else None
+
+    mapped = {prop for prop, value_type in EVENT_PROPERTY_COLUMNS.values()} | FLATTENED_PROPERTIES
+    extra = {key: value for key, value in properties.items() if key not in mapped}
+    row['extra'] = json.dumps(extra, ensure_ascii=False) if extra else None
+    return row
+
+
+def flatten_record(record):
+    """把一条练习记录展开为一行"""
+    created_at = record.get('created_at')
+    record_date = record.get('date')
+    return {
+        'id': record.get('id'),
+        'created_at': datetime.fromisoformat(created_at.replace('Z', '+00:00')) if created_at else None,
+        'date': date.fromisoformat(record_date) if record_date else None,
+        'type': record.get('type'),
+        'duration': _coerce(record.get('duration'), pa.int64()),
+        'notes': record.get('notes') or None,
+        'breakthrough': record.get('breakthrough') or None,
+        'photo_count': len(record.get('photos') or []),
+    }
+
+
+def make_batch(rows, schema):
+    """把若干行组装成 RecordBatch，字符串列做字典编码"""
+    arrays = []
+    for field in schema:
+        values = [row[field.name] for row in rows]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=field.type.value_type).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def open_writer(path, schema, fmt):
+    """打开列式文件写入器：Parquet 或 Arrow IPC 流（每批可以有自己的字典）"""
+    if fmt == 'parquet':
+        return pq.ParquetWriter(path, schema, compression='zstd')
+    return pa.ipc.new_stream(path, schema)
+
+
+def update_daily(daily, kind, row):
+    """累加按天汇总：活跃用户、事件数、练习次数和时长"""
+    day = row['date']
+    if day is None:
+        return
+    stats = daily[day]
+    if kind == 'events':
+        stats['events'] += 1
+        if row['distinct_id']:
+            stats['users'].add(row['distinct_id'])
+        if row['event'] in PRACTICE_EVENTS and row['duration']:
+            practice = daily[practice_day(row['event'], day, row['record_date'])]
+            practice['practices'] += 1
+            practice['practice_seconds'] += row['duration']
+    elif row['duration']:
+        stats['practices'] += 1
+        stats['practice_seconds'] += row['duration']
+
+
+def daily_rows(daily):
+    """按天汇总转为可保存为 JSON 的列表"""
+    result = []
+    for day in sorted(daily):
+        stats = daily[day]
+        item = {
+            'date': day.isoformat(),
+            'practices': stats['practices'],
+            'practice_seconds': stats['practice_seconds'],
+        }
+        if stats['events']:
+            item['events'] = stats['events']
+            item['active_users'] = len(stats['users'])
+        result.append(item)
+    return result
+
+
+def convert_file(input_path, output_path=None, fmt='parquet', batch_rows=BATCH_ROWS):
+    """
+    流式转换一个 JSON 导出文件，内存中最多保留 batch_rows 行
+    同时写出按天汇总 <输出文件名>.daily.json
+    返回：类型, 行数, 输出路径
+    """
+    kind = detect_kind(input_path)
+    if kind == 'events':
+        rows_iter, flatten, schema = iter_json_array(input_path), flatten_event, EVENT_SCHEMA
+    else:
+        rows_iter, flatten, schema = iter_json_array(input_path, 'records'), flatten_record, RECORD_SCHEMA
+
+    if output_path is None:
+        output_path = os.path.splitext(input_path)[0] + OUTPUT_FORMATS[fmt]
+    temp_path = output_path + '.tmp'
+
+    daily = defaultdict(lambda: {'users': set(), 'events': 0, 'practices': 0, 'practice_seconds': 0})
+    total = 0
+    writer = open_writer(temp_path, schema, fmt)
+    try:
+        batch = []
+        for item in rows_iter:
+            row = flatten(item)
+            update_daily(daily, kind, row)
+            batch.append(row)
+            if len(batch) >= batch_rows:
+                writer.write_batch(make_batch(batch, schema))
+                total += len(batch)
+                batch = []
+        if batch:
+            writer.write_batch(make_batch(batch, schema))
+            total += len(batch)
+        writer.close()
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            writer.close()
+            os.remove(temp_path)
+
+    with open(os.path.splitext(output_path)[0] + DAILY_SUFFIX, 'w', encoding='utf-8') as f:
+        json.dump({'source': os.path.basename(input_path), 'days': daily_rows(daily)},
+                  f, ensure_ascii=False, indent=2)
+
+    return kind, total, output_path
+
+
+def read_schema(path):
+    """读取列式文件的结构（不读取数据）"""
+    if path.endswith('.parquet'):
+        return pq.read_schema(path)
+    with pa.ipc.open_stream(path) as reader:
+        return reader.schema
+
+
+def iter_columns(path, columns):
+    """只读取指定的列，逐批返回 {列名: 值列表}"""
+    if path.endswith('.parquet'):
+        for batch in pq.ParquetFile(path).iter_batches(columns=columns):
+            yield batch.to_pydict()
+    else:
+        with pa.ipc.open_stream(path) as reader:
+            for batch in reader:
+                yield batch.select(columns).to_pydict()
+
+
+def daily_active_users(path):
+    """按天统计活跃用户数（distinct_id 去重）"""
+    users = defaultdict(set)
+    for batch in iter_columns(path, ['date', 'distinct_id']):
+        for day, distinct_id in zip(batch['date'], batch['distinct_id']):
+            if day is not None and distinct_id:
+                users[day].add(distinct_id)
+    return {day: len(users[day]) for day in sorted(users)}
+
+
+def practice_totals(path):
+    """
+    按天统计练习次数和时长（秒）：事件文件统计练习事件（补卡按补卡的日期），
+    练习记录文件统计全部记录
+    """
+    totals = defaultdict(lambda: [0, 0])
+    if 'event' in read_schema(path).names:
+        for batch in iter_columns(path, ['date', 'record_date', 'event', 'duration']):
+            for day, record_date, event, duration in zip(batch['date'], batch['record_date'],
+                                                         batch['event'], batch['duration']):
+                if day is not None and event in PRACTICE_EVENTS and duration:
+                    day = practice_day(event, day, record_date)
+                    totals[day][0] += 1
+                    totals[day][1] += duration
+    else:
+        for batch in iter_columns(path, ['date', 'duration']):
+            for day, duration in zip(batch['date'], batch['duration']):
+                if day is not None and duration:
+                    totals[day][0] += 1
+                    totals[day][1] += duration
+    return {day: tuple(totals[day]) for day in sorted(totals)}
+
+
+# 自检用的 JSON：裸数字、科学计数法、负数、嵌套值，逐字符读取时每个数字都会被块边界截断
+SELFCHECK_VALUES = [12345, -1.5e3, 0, 1e10, -0.25, 3.0e-2, 1e-7, 99999999999999999999,
+                    True, False, None, "1.5", [1, 2.5], {"duration": -12.5e1}]
+
+
+def self_check(chunk_sizes=(1, 2, 3, 7)):
+    """
+    用很小的块大小读取 SELFCHECK_VALUES，结果与 json.loads 一致时返回空列表，否则返回错误说明
+    同时检查顶层数组和位于 records 字段中的数组两种结构
+    """
+    errors = []
+    documents = [
+        (None, json.dumps(SELFCHECK_VALUES)),
+        ('records', json.dumps({'version': 1.25e3, 'records': SELFCHECK_VALUES}, indent=1)),
+    ]
+    with tempfile.TemporaryDirectory(prefix='json_check_') as tmp:
+        for key, text in documents:
+            path = os.path.join(tmp, 'check.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            for chunk_size in chunk_sizes:
+                try:
+                    values = list(iter_json_array(path, key, chunk_size))
+                except ValueError as e:
+                    values = e
+                if values != SELFCHECK_VALUES:
+                    errors.append(f"key={key} chunk_size={chunk_size}: {values!r}")
+    return errors
+
+
+def default_inputs():
+    """默认处理脚本目录下的事件导出和练习记录导出（跳过之前生成的按天汇总）"""
+    paths = []
+    for pattern in DEFAULT_INPUTS:
+        matches = glob.glob(os.path.join(SCRIPT_DIR, pattern))
+        paths.extend(sorted(path for path in matches if not path.endswith(DAILY_SUFFIX)))
+    return paths
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="埋点数据转列式存储工具")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    convert = commands.add_parser('convert', help="把 JSON 导出文件转换为列式存储")
+    convert.add_argument('inputs', nargs='*',
+                         help="JSON 导出文件（默认为脚本目录下的 events-export-*.json 和 import-records.json）")
+    convert.add_argument('--format', choices=list(OUTPUT_FORMATS), default='parquet',
+                         help="输出格式（默认 parquet）")
+    convert.add_argument('--out-dir', default=None,
+                         help="输出目录（默认与输入文件同目录）")
+    convert.add_argument('--batch-rows', type=int, default=BATCH_ROWS,
+                         help=f"每批写入的行数（默认 {BATCH_ROWS}）")
+
+    query = commands.add_parser('query', help="按天查询列式文件，只读取需要的列")
+    query.add_argument('path')
+    query.add_argument('metric', choices=['dau', 'practice'],
+                       help="dau: 日活用户；practice: 练习次数和时长")
+
+    commands.add_parser('selfcheck', help="检查流式 JSON 解析在块边界截断数字时的正确性")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.command == 'convert':
+        inputs = args.inputs or default_inputs()
+        if not inputs:
+            print("[错误] 没有找到要转换的文件")
+            sys.exit(1)
+        if args.out_dir:
+            os.makedirs(args.out_dir, exist_ok=True)
+
+        for input_path in inputs:
+            output_path = None
+            if args.out_dir:
+                name = os.path.splitext(os.path.basename(input_path))[0] + OUTPUT_FORMATS[args.format]
+                output_path = os.path.join(args.out_dir, name)
+            kind, total, output_path = convert_file(input_path, output_path, args.format, args.batch_rows)
+            print(f"  [OK] {input_path} -> {output_path}（{'事件' if kind == 'events' else '练习记录'} {total} 条）")
+
+    elif args.command == 'query':
+        if args.metric == 'dau':
+            print("日期\t活跃用户")
+            for day, users in daily_active_users(args.path).items():
+                print(f"{day}\t{users}")
+        else:
+            print("日期\t练习次数\t练习时长（分钟）")
+            for day, (count, seconds) in practice_totals(args.path).items():
+                print(f"{day}\t{count}\t{seconds / 60:.0f}")
+
+    elif args.command == 'selfcheck':
+        errors = self_check()
+        if errors:
+            print("流式 JSON 解析结果不一致:")
+            for line in errors:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("流式 JSON 解析自检通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,242 @@
-import pandas as pd
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Excel 转 txt 工具
+以只读流式方式逐行读取工作簿的所有工作表，分块写入 txt，内存占用不随表格大小增长
+支持传入目录：并行转换目录下所有工作簿，修改时间未变化的工作簿直接跳过
 
-# 读取Excel文件
-df = pd.read_excel(r'C:\Users\BIN\Desktop\阿斯汤加小红书文案风格.xlsx')
+用法:
+  python convert_excel_to_txt.py
+  python convert_excel_to_txt.py 文案目录 --workers 4
+"""
 
-# 保存为txt文件
-output_file = r'C:\Users\BIN\Desktop\阿斯汤加小红书文案风格.txt'
-with open(output_file, 'w', encoding='utf-8') as f:
-    f.write(df.to_string())
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
-print(f"已成功转换为txt文件：{output_file}")
-print(f"共 {len(df)} 行数据")
+from openpyxl import load_workbook
+
+# 配置参数
+INPUT_FILE = r'C:\Users\BIN\Desktop\阿斯汤加小红书文案风格.xlsx'
+SUPPORTED_FORMATS = ['.xlsx', '.xlsm']
+# 每累积多少行写一次文件
+CHUNK_ROWS = 1000
+# 记录已转换工作簿修改时间的文件（与 txt 放在同一目录）
+STATE_FILE = '.excel_to_txt_state.json'
+
+
+def output_path_for(workbook_path, out_dir=None, relative_dir=''):
+    """
+    txt 输出路径：默认与工作簿同目录同名
+    指定 out_dir 时保留工作簿相对输入目录的子目录，避免不同子目录下的同名工作簿互相覆盖
+    """
+    name = os.path.splitext(os.path.basename(workbook_path))[0] + '.txt'
+    if not out_dir:
+        return os.path.join(os.path.dirname(workbook_path), name)
+    return os.path.join(out_dir, relative_dir, name)
+
+
+def format_cell(value):
+    """单元格转文本：空单元格为空字符串，单元格内换行写成 \\n，保证一行数据占一行"""
+    if value is None:
+        return ''
+    return str(value).replace('\r\n', '\n').replace('\n', '\\n').replace('\t', ' ')
+
+
+def format_row(row):
+    """一行数据转为制表符分隔的文本，去掉末尾的空单元格"""
+    cells = [format_cell(value) for value in row]
+    while cells and cells[-1] == '':
+        cells.pop()
+    return '\t'.join(cells)
+
+
+def convert_workbook(workbook_path, output_file, chunk_rows=CHUNK_ROWS):
+    """
+    流式转换一个工作簿的所有工作表
+    返回：工作表数, 数据行数
+    """
+    workbook = load_workbook(workbook_path, read_only=True, data_only=True)
+    temp_file = output_file + '.tmp'
+    sheets = 0
+    rows = 0
+
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            for sheet in workbook.worksheets:
+                sheets += 1
+                f.write(f"===== 工作表: {sheet.title} =====\n")
+
+                chunk = []
+                for row in sheet.iter_rows(values_only=True):
+                    chunk.append(format_row(row))
+                    if len(chunk) >= chunk_rows:
+                        f.write('\n'.join(chunk) + '\n')
+                        rows += len(chunk)
+                        chunk = []
+                if chunk:
+                    f.write('\n'.join(chunk) + '\n')
+                    rows += len(chunk)
+                f.write('\n')
+        os.replace(temp_file, output_file)
+    finally:
+        # 只读模式会保持文件打开，需要显式关闭
+        workbook.close()
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+    return sheets, rows
+
+
+def _convert_worker(workbook_path, output_file, chunk_rows):
+    """进程池中执行的转换任务，返回：工作表数, 数据行数, 错误信息"""
+    try:
+        sheets, rows = convert_workbook(workbook_path, output_file, chunk_rows)
+        return sheets, rows, None
+    except Exception as e:
+        return 0, 0, str(e)
+
+
+def find_workbooks(paths):
+    """
+    展开输入：文件直接使用，目录递归查找所有工作簿（跳过 Excel 的 ~$ 临时文件）
+    返回：[(工作簿路径, 相对输入目录的子目录)]
+    """
+    workbooks = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                relative_dir = os.path.relpath(root, path)
+                if relative_dir == os.curdir:
+                    relative_dir = ''
+                for file in sorted(files):
+                    if file.startswith('~$'):
+                        continue
+                    if os.path.splitext(file)[1].lower() in SUPPORTED_FORMATS:
+                        workbooks.append((os.path.join(root, file), relative_dir))
+        else:
+            workbooks.append((path, ''))
+    return workbooks
+
+
+def load_state(state_path):
+    """读取输出目录中记录的已转换工作簿"""
+    try:
+        with open(state_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state_path, state):
+    """写入已转换工作簿的记录"""
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+
+def workbook_signature(workbook_path):
+    """工作簿的大小和修改时间"""
+    st = os.stat(workbook_path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def convert_all(paths, out_dir=None, workers=1, chunk_rows=CHUNK_ROWS, force=False):
+    """
+    转换所有工作簿，修改时间未变化且 txt 仍存在的跳过
+    返回：统计信息
+    """
+    stats = {'total': 0, 'converted': 0, 'skipped': 0, 'failed': 0, 'rows': 0}
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+
+    # 按输出目录分组记录状态：{状态文件路径: {工作簿绝对路径: [大小, 修改时间]}}
+    states = {}
+    jobs = []
+    # 本次运行中已分配的 txt 路径：{规范化路径: 工作簿路径}
+    outputs = {}
+    for workbook_path, relative_dir in find_workbooks(paths):
+        stats['total'] += 1
+        if not os.path.isfile(workbook_path):
+            print(f"  [失败] 文件不存在: {workbook_path}")
+            stats['failed'] += 1
+            continue
+
+        output_file = output_path_for(workbook_path, out_dir, relative_dir)
+        output_key = os.path.normcase(os.path.abspath(output_file))
+        if output_key in outputs:
+            print(f"  [失败] {workbook_path}: 与 {outputs[output_key]} 输出到同一个文件 {output_file}")
+            stats['failed'] += 1
+            continue
+        outputs[output_key] = workbook_path
+
+        state_path = os.path.join(os.path.dirname(output_file), STATE_FILE)
+        if state_path not in states:
+            states[state_path] = load_state(state_path)
+        state = states[state_path]
+
+        key = os.path.abspath(workbook_path)
+        signature = workbook_signature(workbook_path)
+        if not force and state.get(key) == signature and os.path.exists(output_file):
+            print(f"  [跳过] 未修改: {workbook_path}")
+            stats['skipped'] += 1
+            continue
+        os.makedirs(os.path.dirname(output_file) or os.curdir, exist_ok=True)
+        jobs.append((workbook_path, output_file, state_path, key, signature))
+
+    def record(job, sheets, rows, error):
+        workbook_path, output_file, state_path, key, signature = job
+        if error:
+            print(f"  [失败] {workbook_path}: {error}")
+            stats['failed'] += 1
+            return
+        print(f"  [OK] {workbook_path} -> {output_file}（{sheets} 个工作表，{rows} 行）")
+        stats['converted'] += 1
+        stats['rows'] += rows
+        states[state_path][key] = signature
+        # 每转换完一个就保存，中断后重新运行不会重复转换
+        save_state(state_path, states[state_path])
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_convert_worker, job[0], job[1], chunk_rows) for job in jobs]
+            for job, future in zip(jobs, futures):
+                record(job, *future.result())
+    else:
+        for job in jobs:
+            record(job, *_convert_worker(job[0], job[1], chunk_rows))
+
+    return stats
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="Excel 转 txt 工具")
+    parser.add_argument('inputs', nargs='*', default=[INPUT_FILE],
+                        help="工作簿文件或目录（默认为桌面上的文案表格）")
+    parser.add_argument('--out-dir', default=None,
+                        help="txt 输出目录（默认与工作簿同目录；输入为目录时保留子目录结构）")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="并行转换的进程数（默认 1）")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS,
+                        help=f"每累积多少行写一次文件（默认 {CHUNK_ROWS}）")
+    parser.add_argument('--force', action='store_true',
+                        help="忽略修改时间记录，全部重新转换")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    stats = convert_all(args.inputs, args.out_dir, args.workers, args.chunk_rows, args.force)
+
+    print(f"\n共 {stats['total']} 个工作簿：转换 {stats['converted']}，"
+          f"跳过 {stats['skipped']}，失败 {stats['failed']}")
+    print(f"共 {stats['rows']} 行数据")
+    if stats['failed']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()